@@ -2,12 +2,13 @@ from fastapi import FastAPI, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from typing import List, Optional
+from product_store import ProductStore
 
 app = FastAPI()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-products_db = []
+products_db = ProductStore()
 
 class Product(BaseModel):
     id: str
@@ -29,7 +30,7 @@ async def create_product(
 ):
     product_id = f"prod_{len(products_db) + 1}"
     new_product = Product(id=product_id, **product.dict())
-    products_db.append(new_product.dict())
+    products_db.add(new_product.dict())
     return new_product
 
 @app.get("/products/", response_model=List[Product])
@@ -38,13 +39,11 @@ async def get_products(
     skip: int = 0,
     limit: int = 10
 ):
-    if category:
-        return [p for p in products_db if p["category"] == category][skip:skip + limit]
-    return products_db[skip:skip + limit]
+    return products_db.page(category, skip, limit)
 
 @app.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str):
-    for product in products_db:
-        if product["id"] == product_id:
-            return product
-    raise HTTPException(status_code=404, detail="Product not found")
\ No newline at end of file
+    product = products_db.get(product_id)
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
\ No newline at end of file
@@ -0,0 +1,31 @@
+from collections import defaultdict
+
+
+class ProductStore:
+    """Хранилище продуктов в памяти.
+
+    Продукты лежат в словаре по id, а вторичный индекс по категории хранит
+    id в порядке добавления: поиск по id - O(1), страница категории - O(размер страницы).
+    """
+
+    def __init__(self):
+        self.by_id = {}
+        self.ids = []
+        self.by_category = defaultdict(list)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def add(self, product: dict):
+        product_id = product["id"]
+        self.by_id[product_id] = product
+        self.ids.append(product_id)
+        if product.get("category"):
+            self.by_category[product["category"]].append(product_id)
+
+    def get(self, product_id: str):
+        return self.by_id.get(product_id)
+
+    def page(self, category, skip: int, limit: int):
+        ids = self.by_category.get(category, []) if category else self.ids
+        return [self.by_id[product_id] for product_id in ids[skip:skip + limit]]
@@ -1,3 +1,7 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
@@ -5,14 +9,25 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from search_index import TrigramIndex
 
 app = FastAPI()
 
 SECRET_KEY = "my-secret-key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+
+# Хеши с другим числом раундов считаются устаревшими и пересчитываются при входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -28,6 +43,10 @@ users_db = {
 
 carts_db = {}
 
+name_index = TrigramIndex()
+for username, user_data in users_db.items():
+    name_index.add(username, user_data["full_name"])
+
 
 class User(BaseModel):
     username: str
@@ -66,8 +85,70 @@ class Cart(BaseModel):
     items: List[CartItem]
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+password_executor: Optional[ProcessPoolExecutor] = None
+password_semaphore: Optional[asyncio.Semaphore] = None
+password_stats = {"calls": 0, "queue_time_total": 0.0, "queue_time_max": 0.0, "run_time_total": 0.0}
+
+
+def _hash_password(password: str):
+    return pwd_context.hash(password)
+
+
+def _verify_password(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+def start_password_pool():
+    global password_executor, password_semaphore
+    password_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    password_semaphore = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+
+
+async def run_password_task(func, *args):
+    """bcrypt выполняется в пуле процессов и не блокирует event loop"""
+    queued = time.perf_counter()
+    async with password_semaphore:
+        started = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    waited = started - queued
+    password_stats["calls"] += 1
+    password_stats["queue_time_total"] += waited
+    password_stats["queue_time_max"] = max(password_stats["queue_time_max"], waited)
+    password_stats["run_time_total"] += time.perf_counter() - started
+    return result
+
+
+async def hash_password(password: str):
+    return await run_password_task(_hash_password, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    """Возвращает (пароль верен, новый хеш или None)"""
+    return await run_password_task(_verify_password, password, hashed_password)
+
+
+def get_password_stats():
+    calls = password_stats["calls"]
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "concurrency": PASSWORD_HASH_CONCURRENCY,
+        "bcrypt_rounds": BCRYPT_ROUNDS,
+        "calls": calls,
+        "queue_time_avg_ms": password_stats["queue_time_total"] / calls * 1000 if calls else 0.0,
+        "queue_time_max_ms": password_stats["queue_time_max"] * 1000,
+        "run_time_avg_ms": password_stats["run_time_total"] / calls * 1000 if calls else 0.0,
+    }
+
+
+@app.on_event("startup")
+async def startup_event():
+    start_password_pool()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if password_executor is not None:
+        password_executor.shutdown()
 
 
 def get_user(db, username: str):
@@ -76,12 +157,16 @@ def get_user(db, username: str):
         return UserInDB(**user_dict)
 
 
-def authenticate_user(username: str, password: str):
+async def authenticate_user(username: str, password: str):
     user = get_user(users_db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash is not None:
+        # Пока пароль известен, заменяем хеш с устаревшими параметрами
+        users_db[username]["hashed_password"] = new_hash
     return user
 
 
@@ -118,7 +203,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -137,11 +222,12 @@ async def create_user(user: UserCreate):
     if user.username in users_db:
         raise HTTPException(status_code=400, detail="Username already registered")
 
-    hashed_password = pwd_context.hash(user.password)
+    hashed_password = await hash_password(user.password)
     user_dict = user.dict()
     user_dict["hashed_password"] = hashed_password
     user_dict["disabled"] = False
     users_db[user.username] = user_dict
+    name_index.add(user.username, user.full_name)
 
     carts_db[user.username] = {"user_id": user.username, "items": []}
 
@@ -165,11 +251,7 @@ async def search_users(name: Optional[str] = None):
     if not name:
         return []
 
-    results = []
-    for username, user_data in users_db.items():
-        if name.lower() in user_data["full_name"].lower():
-            results.append(User(**user_data))
-    return results
+    return [User(**users_db[username]) for username in name_index.search(name)]
 
 
 @app.post("/cart/add", response_model=Cart)
@@ -198,4 +280,9 @@ async def add_to_cart(
 async def get_cart(current_user: User = Depends(get_current_user)):
     if current_user.username not in carts_db:
         return {"user_id": current_user.username, "items": []}
-    return carts_db[current_user.username]
\ No newline at end of file
+    return carts_db[current_user.username]
+
+
+@app.get("/stats")
+async def get_stats():
+    return {"password_hashing": get_password_stats()}
@@ -0,0 +1,77 @@
+"""Задержка поиска пользователей по имени в зависимости от размера хранилища.
+
+Сравнивает полный перебор users_db (как было) с триграммным индексом.
+Запуск: python benchmark_search.py [--sizes 1000 10000 100000 1000000]
+"""
+import argparse
+import random
+import string
+import time
+
+from search_index import TrigramIndex
+
+FIRST_NAMES = ["Ivan", "Petr", "Anna", "Maria", "Ilya", "Olga", "Sergey", "Elena", "Dmitry", "Natalia",
+               "Alexey", "Irina", "Pavel", "Tatiana", "Nikolay", "Svetlana", "Andrey", "Yulia", "Mikhail", "Daria"]
+
+
+def random_surname(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 9))).capitalize()
+
+
+def build_store(size, rng):
+    users_db = {}
+    for i in range(size):
+        username = f"user{i}"
+        users_db[username] = {"username": username, "full_name": f"{rng.choice(FIRST_NAMES)} {random_surname(rng)}"}
+    return users_db
+
+
+def make_queries(users_db, count, rng):
+    """Фрагменты фамилий существующих пользователей (4-5 символов)"""
+    surnames = [u["full_name"].split()[1] for u in rng.sample(list(users_db.values()), min(count, len(users_db)))]
+    queries = []
+    for surname in surnames:
+        length = rng.randint(4, 5)
+        start = rng.randint(0, len(surname) - length)
+        queries.append(surname[start:start + length])
+    return queries
+
+
+def scan_search(users_db, name):
+    return [u for u in users_db.values() if name.lower() in u["full_name"].lower()]
+
+
+def measure(search, queries):
+    started = time.perf_counter()
+    for query in queries:
+        search(query)
+    return (time.perf_counter() - started) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'users':>10} {'scan, ms':>10} {'index, ms':>10} {'speedup':>8} {'build, s':>9}")
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        users_db = build_store(size, rng)
+        queries = make_queries(users_db, args.queries, rng)
+
+        started = time.perf_counter()
+        index = TrigramIndex()
+        for username, user in users_db.items():
+            index.add(username, user["full_name"])
+        build_time = time.perf_counter() - started
+
+        # Перебор на больших объемах медленный, для него хватает части запросов
+        scan_ms = measure(lambda q: scan_search(users_db, q), queries[:max(10, len(queries) * 1000 // size)])
+        index_ms = measure(index.search, queries)
+        print(f"{size:>10} {scan_ms:>10.3f} {index_ms:>10.3f} {scan_ms / index_ms:>7.1f}x {build_time:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from collections import defaultdict
+from itertools import count
+
+
+def trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Инвертированный индекс триграмм для поиска по подстроке без учета регистра.
+
+    Запрос сужается до пересечения списков его триграмм, и только эти
+    кандидаты проверяются на точное вхождение подстроки.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.texts = {}
+        self.order = {}
+        self.sequence = count()
+
+    def add(self, key: str, text: str):
+        if key in self.texts:
+            self.remove(key)
+        lowered = text.lower()
+        self.texts[key] = lowered
+        self.order[key] = next(self.sequence)
+        for gram in trigrams(lowered):
+            self.postings[gram].add(key)
+
+    def remove(self, key: str):
+        lowered = self.texts.pop(key, None)
+        if lowered is None:
+            return
+        self.order.pop(key, None)
+        for gram in trigrams(lowered):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def candidates(self, query: str):
+        grams = trigrams(query)
+        if not grams:
+            # Запрос короче триграммы: индекс не помогает, проверяем все ключи
+            return self.texts.keys()
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        result = set(postings[0])
+        for keys in postings[1:]:
+            if not result:
+                break
+            result &= keys
+        return result
+
+    def search(self, query: str):
+        """Ключи, текст которых содержит query, в порядке добавления"""
+        query = query.lower()
+        found = [key for key in self.candidates(query) if query in self.texts[key]]
+        found.sort(key=self.order.__getitem__)
+        return found
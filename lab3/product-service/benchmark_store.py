@@ -0,0 +1,67 @@
+"""Поиск продукта по id и постраничная выдача категории: список против ProductStore.
+
+Запуск: python benchmark_store.py [--sizes 100000 1000000]
+"""
+import argparse
+import random
+import time
+
+from product_store import ProductStore
+
+CATEGORIES = [f"category_{i}" for i in range(20)]
+
+
+def build_products(size, rng):
+    return [
+        {"id": f"prod_{i + 1}", "name": f"Product {i + 1}", "price": 1.0, "category": rng.choice(CATEGORIES)}
+        for i in range(size)
+    ]
+
+
+def list_get(products, product_id):
+    for product in products:
+        if product["id"] == product_id:
+            return product
+
+
+def list_page(products, category, skip, limit):
+    return [p for p in products if p["category"] == category][skip:skip + limit]
+
+
+def measure(func, calls):
+    started = time.perf_counter()
+    for args in calls:
+        func(*args)
+    return (time.perf_counter() - started) / len(calls) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'products':>10} {'operation':>22} {'list, ms':>10} {'store, ms':>10} {'speedup':>9}")
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        products = build_products(size, rng)
+        store = ProductStore()
+        for product in products:
+            store.add(product)
+
+        ids = [(f"prod_{rng.randint(1, size)}",) for _ in range(args.calls)]
+        deep_skip = size // len(CATEGORIES) // 2
+        pages = [(rng.choice(CATEGORIES), rng.randint(0, deep_skip), 10) for _ in range(args.calls)]
+
+        for operation, slow, fast, calls in (
+            ("get by id", lambda pid: list_get(products, pid), store.get, ids),
+            ("category page", lambda c, s, l: list_page(products, c, s, l), store.page, pages),
+        ):
+            slow_ms = measure(slow, calls)
+            fast_ms = measure(fast, calls)
+            print(f"{size:>10} {operation:>22} {slow_ms:>10.3f} {fast_ms:>10.4f} {slow_ms / fast_ms:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
+import base64
 import logging
-from fastapi import FastAPI, Depends, HTTPException, status
+import os
+import time
+from collections import OrderedDict
+from fastapi import FastAPI, Depends, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timedelta
 import jwt
 from passlib.context import CryptContext
@@ -23,11 +30,28 @@ app = FastAPI()
 
 MONGO_URL = "mongodb://mongo:27017"
 DATABASE_NAME = "shop_db"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+PRODUCTS_DEFAULT_LIMIT = int(os.getenv("PRODUCTS_DEFAULT_LIMIT", "10"))
+PRODUCTS_MAX_LIMIT = int(os.getenv("PRODUCTS_MAX_LIMIT", "100"))
 
 SECRET_KEY = "my-secret-key"
 ALGORITHM = "HS256"
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="http://user-service:8000/token")
 
+# Из MongoDB забираем только поля модели Product; product_id отдается как id
+PRODUCT_PROJECTION = {
+    "_id": 0,
+    "id": "$product_id",
+    "name": 1,
+    "description": 1,
+    "price": 1,
+    "category": 1,
+}
+
 class Product(BaseModel):
     id: str
     name: str
@@ -41,22 +65,32 @@ class ProductCreate(BaseModel):
     price: float
     category: Optional[str] = None
 
+mongo_client: Optional[AsyncIOMotorClient] = None
+
+def create_mongo_client():
+    return AsyncIOMotorClient(
+        MONGO_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    )
+
 async def get_db():
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client[DATABASE_NAME]
-    try:
-        yield db
-    finally:
-        client.close()
+    return mongo_client[DATABASE_NAME]
 
 @app.on_event("startup")
 async def startup_event():
+    global mongo_client
     logger.info("Initializing MongoDB...")
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client[DATABASE_NAME]
+    # Один клиент (и пул соединений) на все время жизни процесса
+    mongo_client = create_mongo_client()
+    db = mongo_client[DATABASE_NAME]
     try:
+        await mongo_client.admin.command("ping")
+        logger.info(f"MongoDB client ready (minPoolSize={MONGO_MIN_POOL_SIZE}, maxPoolSize={MONGO_MAX_POOL_SIZE})")
         await db.products.create_index([("product_id", 1)], unique=True)
-        await db.products.create_index([("category", 1)])
+        # Покрывает и фильтр по категории, и сортировку по _id для курсора
+        await db.products.create_index([("category", 1), ("_id", 1)])
         logger.info("MongoDB indexes created")
 
         if await db.products.count_documents({}) == 0:
@@ -82,7 +116,66 @@ async def startup_event():
     except Exception as e:
         logger.error(f"MongoDB initialization error: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if mongo_client is not None:
+        mongo_client.close()
+        logger.info("MongoDB client closed")
+
+class PrincipalCache:
+    """Кеш результатов проверки токена (имя пользователя по токену).
+
+    Запись живет не дольше PRINCIPAL_CACHE_TTL и не дольше срока действия
+    самого токена; invalidate() сразу сбрасывает все токены пользователя.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tokens_by_subject = {}
+
+    def get(self, token: str):
+        item = self.entries.get(token)
+        if item is None:
+            return None
+        principal, subject, expires_at = item
+        if time.time() >= expires_at:
+            self._remove(token)
+            return None
+        self.entries.move_to_end(token)
+        return principal
+
+    def set(self, token: str, subject: str, principal, token_expires_at: Optional[float] = None):
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        self._remove(token)
+        self.entries[token] = (principal, subject, expires_at)
+        self.tokens_by_subject.setdefault(subject, set()).add(token)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def invalidate(self, subject: str):
+        for token in self.tokens_by_subject.pop(subject, set()):
+            self.entries.pop(token, None)
+
+    def _remove(self, token: str):
+        item = self.entries.pop(token, None)
+        if item is None:
+            return
+        tokens = self.tokens_by_subject.get(item[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_subject[item[1]]
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL)
+
 async def verify_token(token: str = Depends(oauth2_scheme)):
+    username = principal_cache.get(token)
+    if username is not None:
+        return username
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -92,6 +185,7 @@ async def verify_token(token: str = Depends(oauth2_scheme)):
                 detail="Invalid credentials",
             )
         logger.info(f"Authenticated user: {username}")
+        principal_cache.set(token, username, username, payload.get("exp"))
         return username
     except jwt.ExpiredSignatureError:
         logger.warning("Token expired")
@@ -114,32 +208,63 @@ async def create_product(
             **product.dict(),
             "created_at": datetime.utcnow()
         })
-        new_product = await db.products.find_one({"product_id": product_id})
+        new_product = await db.products.find_one({"product_id": product_id}, PRODUCT_PROJECTION)
         logger.info(f"Product created: {product_id}")
         return new_product
     except Exception as e:
         logger.error(f"Error creating product: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+def encode_product_cursor(object_id: ObjectId):
+    return base64.urlsafe_b64encode(object_id.binary).decode()
+
+def decode_product_cursor(cursor: str):
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_product_page(db, category: Optional[str], skip: int, limit: int, after: Optional[str]):
+    """Страница продуктов в порядке _id и курсор следующей страницы (или None)
+
+    С курсором выборка продолжается по индексу (category, _id) без skip;
+    skip оставлен для старых клиентов и применяется только без курсора.
+    """
+    query = {"category": category} if category else {}
+    if after:
+        query["_id"] = {"$gt": decode_product_cursor(after)}
+    cursor = db.products.find(query, {**PRODUCT_PROJECTION, "_id": 1}).sort("_id", 1)
+    if skip and not after:
+        cursor = cursor.skip(skip)
+    products = await cursor.limit(limit).to_list(limit)
+    next_cursor = None
+    if len(products) == limit:
+        next_cursor = encode_product_cursor(products[-1]["_id"])
+    for product in products:
+        del product["_id"]
+    return products, next_cursor
+
 @app.get("/products/", response_model=List[Product])
 async def get_products(
     category: Optional[str] = None,
-    skip: int = 0,
-    limit: int = 10,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(PRODUCTS_DEFAULT_LIMIT, ge=1, le=PRODUCTS_MAX_LIMIT),
+    after: Optional[str] = None,
     db=Depends(get_db)
 ):
     """Получение списка продуктов из MongoDB"""
-    query = {"category": category} if category else {}
-    products = await db.products.find(query).skip(skip).limit(limit).to_list(limit)
-    return products
+    products, next_cursor = await fetch_product_page(db, category, skip, limit, after)
+    # Документы уже в форме ответа: отдаем их без повторной валидации response_model
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return ORJSONResponse(products, headers=headers)
 
 @app.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str, db=Depends(get_db)):
     """Получение продукта по ID из MongoDB"""
-    product = await db.products.find_one({"product_id": product_id})
+    product = await db.products.find_one({"product_id": product_id}, PRODUCT_PROJECTION)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return ORJSONResponse(product)
 
 @app.put("/products/{product_id}", response_model=Product)
 async def update_product(
@@ -155,7 +280,7 @@ async def update_product(
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
-    return await db.products.find_one({"product_id": product_id})
+    return await db.products.find_one({"product_id": product_id}, PRODUCT_PROJECTION)
 
 @app.delete("/products/{product_id}", status_code=204)
 async def delete_product(
@@ -1,9 +1,22 @@
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
-from confluent_kafka import Consumer, KafkaError, KafkaException
+from pymongo import InsertOne, UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
+from redis import asyncio as aioredis
+from collections import Counter, OrderedDict
+from prometheus_client import Counter as MetricCounter, Gauge, Histogram, make_wsgi_app
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
 import json
 import asyncio
+import os
+import random
 import socket
+import threading
+import time
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,8 +30,119 @@ logger = logging.getLogger(__name__)
 
 MONGO_URL = "mongodb://mongo:27017"
 DATABASE_NAME = "shop_db"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "20"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+REDIS_URL = "redis://redis:6379"
 KAFKA_BROKER = "kafka:9092"
 KAFKA_TOPIC = "products"
+KAFKA_TOPIC_PARTITIONS = int(os.getenv("KAFKA_TOPIC_PARTITIONS", "6"))
+PROJECTION_WORKERS = int(os.getenv("PROJECTION_WORKERS", "4"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "8"))
+FETCH_QUEUE_SIZE = int(os.getenv("FETCH_QUEUE_SIZE", "4"))
+COMMAND_BATCH_SIZE = int(os.getenv("COMMAND_BATCH_SIZE", "500"))
+COMMAND_BATCH_TIMEOUT = float(os.getenv("COMMAND_BATCH_TIMEOUT", "0.5"))
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "10"))
+# Должен быть больше времени чтения MongoDB в product-service между GET поколения и записью в кеш
+CACHE_GENERATION_TTL = int(os.getenv("CACHE_GENERATION_TTL", "3600"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8002"))
+LAG_UPDATE_INTERVAL = float(os.getenv("LAG_UPDATE_INTERVAL", "5"))
+HEALTH_STALL_TIMEOUT = float(os.getenv("HEALTH_STALL_TIMEOUT", "30"))
+EVENT_ACTIONS = ("create", "update", "delete")
+TRACE_ID_HEADER = "trace_id"
+PRODUCED_AT_HEADER = "produced_at"
+PROPAGATION_SLO = float(os.getenv("PROPAGATION_SLO", "1.0"))
+PROPAGATION_SAMPLE_SIZE = int(os.getenv("PROPAGATION_SAMPLE_SIZE", "10000"))
+
+EVENTS_APPLIED = MetricCounter(
+    "command_handler_events_total",
+    "События, примененные к MongoDB, по типу действия",
+    ["action"],
+)
+APPLY_DURATION = Histogram(
+    "command_handler_apply_duration_seconds",
+    "Время применения пачки событий к MongoDB (bulk_write и сброс кеша)",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+ERRORS = MetricCounter(
+    "command_handler_errors_total",
+    "Ошибки обработки по этапу: kafka, parse, event, write, apply, cache",
+    ["stage"],
+)
+COMMITTED_OFFSET = Gauge(
+    "command_handler_committed_offset",
+    "Зафиксированное смещение группы по партиции",
+    ["partition"],
+)
+HIGH_WATERMARK = Gauge(
+    "command_handler_high_watermark",
+    "Верхняя граница партиции (смещение следующего записанного сообщения)",
+    ["partition"],
+)
+PARTITION_LAG = Gauge(
+    "command_handler_partition_lag",
+    "Отставание: сообщения партиции после зафиксированного смещения",
+    ["partition"],
+)
+LAST_APPLIED_EVENT_TIMESTAMP = Gauge(
+    "command_handler_last_applied_event_timestamp_seconds",
+    "Время публикации (timestamp Kafka) последнего примененного события",
+)
+PROPAGATION_DURATION = Histogram(
+    "command_handler_propagation_seconds",
+    "Задержка распространения записи по этапам: produce-consume (queue), "
+    "consume-apply с ожиданием в очереди воркера (apply) и produce-apply (total)",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+PROPAGATION_SLO_VIOLATIONS = MetricCounter(
+    "command_handler_propagation_slo_violations_total",
+    "События, примененные позже PROPAGATION_SLO секунд после публикации",
+)
+LAST_APPLIED_EVENT_AGE = Gauge(
+    "command_handler_last_applied_event_age_seconds",
+    "Сколько секунд назад было опубликовано последнее примененное событие",
+)
+
+PROPAGATION_QUEUE = PROPAGATION_DURATION.labels("queue")
+PROPAGATION_APPLY = PROPAGATION_DURATION.labels("apply")
+PROPAGATION_TOTAL = PROPAGATION_DURATION.labels("total")
+
+
+# Время публикации последнего примененного события (секунды), 0 - событий еще не было
+last_applied = {"published": 0.0}
+
+
+def last_applied_age():
+    if not last_applied["published"]:
+        return 0.0
+    return max(time.time() - last_applied["published"], 0.0)
+
+
+LAST_APPLIED_EVENT_AGE.set_function(last_applied_age)
+
+
+def create_mongo_client():
+    return AsyncIOMotorClient(
+        MONGO_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    )
+
+
+committed_offsets = {}
+partition_lag = {}
+
+
+def on_commit(err, partitions):
+    if err is not None:
+        ERRORS.labels("kafka").inc()
+        logger.warning(f"Offset commit failed: {err}")
+        return
+    for p in partitions:
+        if p.error is None and p.offset >= 0:
+            committed_offsets[p.partition] = p.offset
 
 
 def create_kafka_consumer():
@@ -28,7 +152,8 @@ def create_kafka_consumer():
         'auto.offset.reset': 'earliest',
         'enable.auto.commit': False,
         'session.timeout.ms': 10000,
-        'heartbeat.interval.ms': 3000
+        'heartbeat.interval.ms': 3000,
+        'on_commit': on_commit
     })
 
 
@@ -45,18 +170,23 @@ async def wait_for_kafka():
 
             metadata = consumer.list_topics(timeout=10)
 
+            from confluent_kafka.admin import AdminClient, NewTopic, NewPartitions
+            admin = AdminClient({'bootstrap.servers': KAFKA_BROKER})
             if KAFKA_TOPIC not in metadata.topics:
-                from confluent_kafka.admin import AdminClient, NewTopic
-                admin = AdminClient({'bootstrap.servers': KAFKA_BROKER})
-                new_topic = NewTopic(KAFKA_TOPIC, num_partitions=1, replication_factor=1)
+                new_topic = NewTopic(KAFKA_TOPIC, num_partitions=KAFKA_TOPIC_PARTITIONS, replication_factor=1)
                 admin.create_topics([new_topic])
                 await asyncio.sleep(2)
+            elif len(metadata.topics[KAFKA_TOPIC].partitions) < KAFKA_TOPIC_PARTITIONS:
+                # Новые партиции меняют соответствие ключ -> партиция только для будущих событий
+                logger.info(f"Increasing {KAFKA_TOPIC} partitions to {KAFKA_TOPIC_PARTITIONS}")
+                admin.create_partitions([NewPartitions(KAFKA_TOPIC, KAFKA_TOPIC_PARTITIONS)])
+                await asyncio.sleep(2)
 
-            consumer.subscribe([KAFKA_TOPIC])
-            consumer.poll(1.0)
-            assignment = consumer.assignment()
-            if not assignment:
-                raise Exception(f"Failed to subscribe to topic {KAFKA_TOPIC}")
+            # Проверяем только метаданные: подписка здесь вызвала бы лишнюю
+            # перебалансировку группы для уже работающих экземпляров
+            metadata = consumer.list_topics(KAFKA_TOPIC, timeout=10)
+            if not metadata.topics[KAFKA_TOPIC].partitions:
+                raise Exception(f"Topic {KAFKA_TOPIC} has no partitions yet")
 
             consumer.close()
             return True
@@ -70,75 +200,608 @@ async def wait_for_kafka():
                 raise
 
 
-async def process_message(db, consumer, msg):
-    """Обработка одного сообщения из Kafka"""
+def parse_message(msg):
+    """Разбор события из сообщения Kafka, None для некорректных сообщений.
+
+    Событие - JSON-объект со строковым product_id; остальное отбрасывается
+    здесь, иначе одно такое сообщение роняло бы обработчик, а его смещение
+    так и не фиксировалось бы.
+    """
     try:
-        product_data = json.loads(msg.value().decode('utf-8'))
-        action = product_data.get("action")
+        event = json.loads((msg.value() or b"").decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        ERRORS.labels("parse").inc()
+        logger.error(f"Invalid message format: {e}")
+        return None
+    if not isinstance(event, dict) or not isinstance(event.get("product_id"), str):
+        ERRORS.labels("parse").inc()
+        logger.error(f"Invalid event at {msg.topic()} [{msg.partition()}] offset {msg.offset()}: {event!r:.200}")
+        return None
+    return event
+
+
+def fold_events(events):
+    """Свертка событий пачки в итоговую операцию для каждого продукта.
+
+    После свертки на каждый product_id остается одна операция, поэтому
+    порядок применения внутри неупорядоченного bulk_write не важен.
+    Исключение - create после update: поштучно update применился бы к
+    существующему продукту, а create отклонен как дубль, либо update ничего
+    не изменил бы, а create создал продукт. Такая пара остается двумя
+    операциями ("update_insert"), insert выполняется вторым проходом.
+    """
+    folded = {}
+    for event in events:
+        action = event.get("action")
+        product_id = event.get("product_id")
+        if product_id is None:
+            ERRORS.labels("event").inc()
+            logger.error(f"Event without product_id: {event}")
+            continue
+        current = folded.get(product_id)
 
         if action == "create":
-            await db.products.insert_one(product_data)
-            logger.info(f"Created product: {product_data['product_id']}")
+            if current is None:
+                folded[product_id] = ("insert", event)
+            elif current[0] == "delete":
+                folded[product_id] = ("replace", event)
+            elif current[0] == "update":
+                folded[product_id] = ("update_insert", {"update": current[1], "insert": event})
+            else:
+                logger.warning(f"Duplicate create for product: {product_id}")
 
         elif action == "update":
-            product_id = product_data["product_id"]
-            update_data = {k: v for k, v in product_data.items()
-                           if k not in ["product_id", "action"]}
-            result = await db.products.update_one(
-                {"product_id": product_id},
-                {"$set": update_data}
-            )
-            if result.modified_count == 0:
+            fields = {k: v for k, v in event.items() if k not in ["product_id", "action"]}
+            if current is None:
+                folded[product_id] = ("update", fields)
+            elif current[0] == "delete":
                 logger.warning(f"Product not found: {product_id}")
+            elif current[0] == "update_insert":
+                # Поправка относится к тому документу, который в итоге окажется в базе
+                folded[product_id] = ("update_insert", {
+                    "update": {**current[1]["update"], **fields},
+                    "insert": {**current[1]["insert"], **fields},
+                })
+            else:
+                folded[product_id] = (current[0], {**current[1], **fields})
 
         elif action == "delete":
-            result = await db.products.delete_one({"product_id": product_data["product_id"]})
-            if result.deleted_count == 0:
-                logger.warning(f"Product not found: {product_data['product_id']}")
+            folded[product_id] = ("delete", None)
 
-        consumer.commit(message=msg, asynchronous=False)
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid message format: {e}")
-    except Exception as e:
-        logger.error(f"Error processing message: {e}")
+        else:
+            ERRORS.labels("event").inc()
+            logger.error(f"Unknown action {action} for product: {product_id}")
+    return folded
+
+
+def build_write_ops(folded):
+    """Операции для двух проходов bulk_write: второй - insert после update того же продукта"""
+    ops, follow_up = [], []
+    for product_id, (kind, data) in folded.items():
+        if kind == "insert":
+            ops.append(InsertOne(data))
+        elif kind == "replace":
+            ops.append(ReplaceOne({"product_id": product_id}, data, upsert=True))
+        elif kind == "update":
+            ops.append(UpdateOne({"product_id": product_id}, {"$set": data}))
+        elif kind == "update_insert":
+            ops.append(UpdateOne({"product_id": product_id}, {"$set": data["update"]}))
+            follow_up.append(InsertOne(data["insert"]))
+        elif kind == "delete":
+            ops.append(DeleteOne({"product_id": product_id}))
+    return ops, follow_up
+
+
+def folded_documents(kind, data):
+    if data is None:
+        return []
+    if kind == "update_insert":
+        return [data["update"], data["insert"]]
+    return [data]
+
+
+def product_cache_key(product_id: str):
+    return f"product:{product_id}"
+
+
+def product_list_cache_key(category):
+    return f"products:{category or '*'}"
+
+
+async def invalidate_cache(cache, folded, old_categories):
+    """Сброс кеша product-service для продуктов пачки и страниц их категорий"""
+    categories = set(old_categories)
+    for kind, data in folded.values():
+        for document in folded_documents(kind, data):
+            if document.get("category"):
+                categories.add(document["category"])
+    keys = [product_cache_key(product_id) for product_id in folded]
+    keys += [product_list_cache_key(category) for category in categories]
+    keys.append(product_list_cache_key(None))
+    # Сначала новое поколение, затем DEL: product-service не запишет в кеш
+    # документ, прочитанный из MongoDB до применения пачки
+    async with cache.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.incr(f"{key}:gen")
+            pipe.expire(f"{key}:gen", CACHE_GENERATION_TTL)
+        pipe.delete(*keys)
+        await pipe.execute()
+
+
+async def bulk_write(db, ops):
+    try:
+        result = await db.products.bulk_write(ops, ordered=False)
+        logger.debug(
+            f"Bulk write: inserted={result.inserted_count}, modified={result.modified_count}, "
+            f"upserted={result.upserted_count}, deleted={result.deleted_count}"
+        )
+    except BulkWriteError as e:
+        # Остальные операции пачки применены, ошибочные (например, дубли) пропускаем
+        ERRORS.labels("write").inc(len(e.details.get("writeErrors", [])))
+        for error in e.details.get("writeErrors", []):
+            logger.error(f"Error processing event: {error.get('errmsg')}")
+
+
+async def apply_events(db, cache, events):
+    """Применение пачки событий к MongoDB одним bulk_write и сброс кеша"""
+    folded = fold_events(events)
+    ops, follow_up = build_write_ops(folded)
+    if not ops:
+        return
+    # Категории до изменения: при смене категории устаревают страницы обеих
+    old_categories = await db.products.distinct("category", {"product_id": {"$in": list(folded)}})
+    try:
+        await bulk_write(db, ops)
+        if follow_up:
+            await bulk_write(db, follow_up)
+    finally:
+        try:
+            await invalidate_cache(cache, folded, old_categories)
+        except Exception as e:
+            ERRORS.labels("cache").inc()
+            logger.error(f"Cache invalidation error: {e}")
+
+
+class OffsetTracker:
+    """Смещения сообщений, переданных воркерам, по партициям.
+
+    Воркеры завершают пачки в произвольном порядке, поэтому фиксировать
+    можно только смещения до первого еще не примененного сообщения партиции.
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def track(self, msg):
+        key = (msg.topic(), msg.partition())
+        self.pending.setdefault(key, OrderedDict())[msg.offset()] = False
+
+    def complete(self, messages):
+        for msg in messages:
+            offsets = self.pending.get((msg.topic(), msg.partition()))
+            if offsets is not None and msg.offset() in offsets:
+                offsets[msg.offset()] = True
+
+    def committable(self, partitions=None):
+        """Позиции для commit: следующее смещение после непрерывного завершенного префикса"""
+        result = []
+        for key, offsets in self.pending.items():
+            if partitions is not None and key not in partitions:
+                continue
+            position = None
+            while offsets:
+                offset, done = next(iter(offsets.items()))
+                if not done:
+                    break
+                offsets.popitem(last=False)
+                position = offset + 1
+            if position is not None:
+                result.append(TopicPartition(key[0], key[1], position))
+        return result
+
+    def forget(self, partitions):
+        for key in partitions:
+            self.pending.pop(key, None)
+
+    def in_flight(self):
+        return sum(len(offsets) for offsets in self.pending.values())
+
+
+def worker_index(product_id: str):
+    """Все события одного продукта обрабатывает один и тот же воркер"""
+    return zlib.crc32(product_id.encode('utf-8')) % PROJECTION_WORKERS
+
+
+async def dispatch_batch(messages, consumed_at, queues, tracker):
+    """Распределение пачки сообщений по воркерам по ключу product_id"""
+    groups = [([], []) for _ in queues]
+    for msg in messages:
+        if msg.error():
+            if msg.error().code() != KafkaError._PARTITION_EOF:
+                ERRORS.labels("kafka").inc()
+                logger.error(f"Kafka error: {msg.error()}")
+            continue
+        tracker.track(msg)
+        event = parse_message(msg)
+        if event is None:
+            # Отброшенное сообщение считается обработанным, чтобы смещение ушло дальше
+            tracker.complete([msg])
+            continue
+        group = groups[worker_index(event["product_id"])]
+        group[0].append(msg)
+        group[1].append(event)
+
+    for queue, (worker_messages, events) in zip(queues, groups):
+        if worker_messages:
+            await queue.put((worker_messages, events, consumed_at))
+
+
+def record_applied(messages, events):
+    # Неизвестные действия сводим в одну метку, чтобы число рядов не зависело от данных
+    actions = Counter(event.get("action") if event.get("action") in EVENT_ACTIONS else "unknown" for event in events)
+    for action, count in actions.items():
+        EVENTS_APPLIED.labels(action).inc(count)
+    # timestamp() - (тип, миллисекунды); без метки времени тип равен TIMESTAMP_NOT_AVAILABLE
+    published = max((msg.timestamp()[1] for msg in messages if msg.timestamp()[0]), default=0)
+    if published / 1000 > last_applied["published"]:
+        last_applied["published"] = published / 1000
+        LAST_APPLIED_EVENT_TIMESTAMP.set(last_applied["published"])
+
+
+def message_headers(msg):
+    return {key: value.decode(errors="replace") for key, value in msg.headers() or () if value is not None}
+
+
+def produced_at(msg, headers):
+    """Время публикации события в секундах, None - если его не узнать"""
+    try:
+        return int(headers[PRODUCED_AT_HEADER]) / 1000
+    except (KeyError, ValueError):
+        pass
+    timestamp_type, timestamp = msg.timestamp()
+    return timestamp / 1000 if timestamp_type else None
+
+
+def record_propagation(messages, consumed_at, stats):
+    """Задержка от публикации события до его применения к MongoDB и сброса кеша,
+    то есть до момента, когда get_product вернет новые данные.
+
+    Время публикации - заголовок produced_at от product-service, для событий
+    без заголовков - timestamp сообщения Kafka. Часы сервисов должны быть синхронизированы.
+    """
+    applied_at = time.time()
+    apply_latency = applied_at - consumed_at
+    slowest = None
+    for msg in messages:
+        headers = message_headers(msg)
+        published = produced_at(msg, headers)
+        if published is None:
+            continue
+        total = max(applied_at - published, 0.0)
+        PROPAGATION_QUEUE.observe(max(consumed_at - published, 0.0))
+        PROPAGATION_APPLY.observe(apply_latency)
+        PROPAGATION_TOTAL.observe(total)
+        sample_propagation(stats, total)
+        if total > PROPAGATION_SLO:
+            PROPAGATION_SLO_VIOLATIONS.inc()
+            if slowest is None or total > slowest[0]:
+                slowest = (total, consumed_at - published, headers.get(TRACE_ID_HEADER), msg.key())
+    if slowest is not None:
+        # Одна запись на пачку - самое медленное событие, чтобы не забивать лог при отставании
+        total, queued, trace_id, key = slowest
+        logger.warning(
+            f"Slow propagation: trace {trace_id}, product {key.decode() if key else None}: "
+            f"{total * 1000:.0f} ms total, {queued * 1000:.0f} ms in Kafka, {apply_latency * 1000:.0f} ms apply"
+        )
+
+
+def sample_propagation(stats, value):
+    """Равномерная выборка (reservoir sampling) задержек за интервал статистики"""
+    stats["propagation_seen"] += 1
+    samples = stats["propagation"]
+    if len(samples) < PROPAGATION_SAMPLE_SIZE:
+        samples.append(value)
+    else:
+        index = random.randrange(stats["propagation_seen"])
+        if index < PROPAGATION_SAMPLE_SIZE:
+            samples[index] = value
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+async def projection_worker(index, db, cache, queue, tracker, stats):
+    """Последовательное применение пачек одного воркера к MongoDB"""
+    while True:
+        messages, events, consumed_at = await queue.get()
+        started = time.perf_counter()
+        try:
+            await apply_events(db, cache, events)
+        except Exception as e:
+            ERRORS.labels("apply").inc()
+            logger.error(f"Worker {index}: error processing batch: {e}")
+        else:
+            # Неудачная пачка не считается примененной: иначе отставание и
+            # пропускная способность выглядели бы нормальными при сбое проекции
+            record_applied(messages, events)
+            record_propagation(messages, consumed_at, stats)
+        APPLY_DURATION.observe(time.perf_counter() - started)
+        tracker.complete(messages)
+        stats["events"] += len(events)
+        stats["batches"] += 1
+        stats["apply_time"] += time.perf_counter() - started
+        queue.task_done()
+
+
+def commit_offsets(consumer, offsets, stats, asynchronous=True):
+    """Фиксация смещений; асинхронный commit не блокирует event loop"""
+    if not offsets:
+        return
+    started = time.perf_counter()
+    consumer.commit(offsets=offsets, asynchronous=asynchronous)
+    stats["commit_time"] += time.perf_counter() - started
+    stats["commits"] += 1
+
+
+def consume_loop(consumer, loop, fetch_queue, stop):
+    """Чтение Kafka в отдельном потоке.
+
+    Блокирующие вызовы librdkafka не занимают event loop, поэтому запись
+    пачки N в MongoDB идет одновременно с получением пачки N + 1.
+    Пока очередь пачек заполнена, поток ждет: так работает backpressure.
+    """
+    while not stop.is_set():
+        try:
+            item = consumer.consume(num_messages=COMMAND_BATCH_SIZE, timeout=COMMAND_BATCH_TIMEOUT)
+        except Exception as e:
+            item = e
+        if not item:
+            continue
+        future = asyncio.run_coroutine_threadsafe(fetch_queue.put((item, time.time())), loop)
+        while True:
+            try:
+                future.result(timeout=1)
+                break
+            except FutureTimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    return
+        if isinstance(item, Exception):
+            return
+
+
+def update_lag(consumer):
+    """Отставание по назначенным партициям: верхняя граница минус зафиксированное смещение.
+
+    cached=True берет границу из последнего ответа на fetch, без запроса к брокеру.
+    """
+    for tp in consumer.assignment():
+        low, high = consumer.get_watermark_offsets(tp, cached=True)
+        if high < 0:
+            continue
+        label = str(tp.partition)
+        HIGH_WATERMARK.labels(label).set(high)
+        committed = committed_offsets.get(tp.partition)
+        if committed is not None:
+            COMMITTED_OFFSET.labels(label).set(committed)
+            partition_lag[tp.partition] = max(high - committed, 0)
+            PARTITION_LAG.labels(label).set(partition_lag[tp.partition])
+
+
+def forget_partition_metrics(partitions):
+    for p in partitions:
+        committed_offsets.pop(p.partition, None)
+        partition_lag.pop(p.partition, None)
+        for gauge in (COMMITTED_OFFSET, HIGH_WATERMARK, PARTITION_LAG):
+            try:
+                gauge.remove(str(p.partition))
+            except KeyError:
+                pass
+
+
+health = {"last_loop": None, "poll_thread": None}
+
+
+def health_status():
+    """200, пока основной цикл крутится и поток чтения Kafka жив, иначе 503"""
+    last_loop = health["last_loop"]
+    poll_thread = health["poll_thread"]
+    if last_loop is None:
+        state = "starting"
+    elif poll_thread is None or not poll_thread.is_alive():
+        state = "consumer_stopped"
+    elif time.monotonic() - last_loop > HEALTH_STALL_TIMEOUT:
+        state = "stalled"
+    else:
+        state = "ok"
+    body = {
+        "status": state,
+        "lag": sum(partition_lag.values()),
+        "last_applied_event_age_seconds": round(last_applied_age(), 3),
+    }
+    return ("200 OK" if state == "ok" else "503 Service Unavailable"), body
+
+
+class MetricsServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server():
+    """HTTP в отдельном потоке: /metrics для Prometheus и /health для оркестратора"""
+    prometheus_app = make_wsgi_app()
+
+    def app(environ, start_response):
+        if environ["PATH_INFO"] == "/health":
+            status, body = health_status()
+            start_response(status, [("Content-Type", "application/json")])
+            return [json.dumps(body).encode()]
+        return prometheus_app(environ, start_response)
+
+    server = make_server("", METRICS_PORT, app, MetricsServer, QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics and health endpoint listening on port {METRICS_PORT}")
+    return server
+
+
+def new_stats():
+    return {
+        "events": 0,
+        "batches": 0,
+        "commits": 0,
+        "apply_time": 0.0,
+        "commit_time": 0.0,
+        "propagation": [],
+        "propagation_seen": 0,
+        "started": time.monotonic(),
+    }
+
+
+def report_stats(stats, tracker, fetch_queue, queues):
+    elapsed = time.monotonic() - stats["started"]
+    batches = stats["batches"]
+    commits = stats["commits"]
+    if batches:
+        logger.info(
+            f"Processed {stats['events']} events in {batches} batches: "
+            f"{stats['events'] / elapsed:.1f} events/s, "
+            f"avg apply {stats['apply_time'] / batches * 1000:.1f} ms per batch, "
+            f"avg commit {stats['commit_time'] / commits * 1000 if commits else 0.0:.1f} ms, "
+            f"in flight {tracker.in_flight()}"
+        )
+    if stats["propagation"]:
+        samples = sorted(stats["propagation"])
+        logger.info(
+            f"Propagation latency: p50 {percentile(samples, 0.5) * 1000:.0f} ms, "
+            f"p99 {percentile(samples, 0.99) * 1000:.0f} ms, max {samples[-1] * 1000:.0f} ms "
+            f"({stats['propagation_seen']} events, SLO {PROPAGATION_SLO * 1000:.0f} ms)"
+        )
+    logger.info(
+        f"Queue depth: fetch {fetch_queue.qsize()}/{FETCH_QUEUE_SIZE}, "
+        f"workers {[queue.qsize() for queue in queues]} (max {WORKER_QUEUE_SIZE})"
+    )
+
+
+def reset_stats(stats):
+    stats.update(new_stats())
 
 
 async def handle_product_commands():
     """Основной цикл обработки команд"""
-    global msg
+    metrics_server = start_metrics_server()
     await wait_for_kafka()
 
-    mongo_client = AsyncIOMotorClient(MONGO_URL)
+    mongo_client = create_mongo_client()
     db = mongo_client[DATABASE_NAME]
+    await mongo_client.admin.command("ping")
+    cache = aioredis.from_url(REDIS_URL, max_connections=PROJECTION_WORKERS, socket_keepalive=True)
 
+    loop = asyncio.get_running_loop()
+    tracker = OffsetTracker()
+    stats = new_stats()
+    fetch_queue = asyncio.Queue(maxsize=FETCH_QUEUE_SIZE)
+    queues = [asyncio.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(PROJECTION_WORKERS)]
     consumer = create_kafka_consumer()
-    consumer.subscribe([KAFKA_TOPIC])
 
-    logger.info("Product Command Handler started successfully")
+    async def drain_partitions(partitions):
+        # Дожидаемся применения всего, что уже прочитано, и забираем смещения отданных партиций
+        await fetch_queue.join()
+        await asyncio.gather(*(queue.join() for queue in queues))
+        offsets = tracker.committable(partitions)
+        tracker.forget(partitions)
+        return offsets
 
-    try:
-        while True:
-            msg = consumer.poll(1.0)
+    def on_assign(consumer, partitions):
+        logger.info(f"Partitions assigned: {[p.partition for p in partitions]}")
+        # Начальные смещения для метрики отставания, дальше их обновляет on_commit
+        try:
+            for p in consumer.committed(partitions, timeout=10):
+                if p.offset >= 0:
+                    committed_offsets[p.partition] = p.offset
+        except KafkaException as e:
+            logger.warning(f"Failed to read committed offsets: {e}")
 
-            if msg is None:
-                continue
+    def on_revoke(consumer, partitions):
+        # Вызывается в потоке чтения: event loop свободен и может доработать пачки
+        keys = {(p.topic, p.partition) for p in partitions}
+        try:
+            offsets = asyncio.run_coroutine_threadsafe(drain_partitions(keys), loop).result(timeout=30)
+            commit_offsets(consumer, offsets, stats, asynchronous=False)
+        except Exception as e:
+            logger.warning(f"Commit on revoke failed: {e}")
+        forget_partition_metrics(partitions)
+        logger.info(f"Partitions revoked: {[p.partition for p in partitions]}")
 
-            if msg.error():
-                if msg.error().code() == KafkaError._PARTITION_EOF:
-                    logger.debug("Reached end of partition")
-                    continue
-                logger.error(f"Kafka error: {msg.error()}")
-                continue
+    consumer.subscribe([KAFKA_TOPIC], on_assign=on_assign, on_revoke=on_revoke)
 
-            await process_message(db, consumer, msg)
+    workers = [
+        asyncio.create_task(projection_worker(i, db, cache, queue, tracker, stats))
+        for i, queue in enumerate(queues)
+    ]
+    stop = threading.Event()
+    poll_thread = threading.Thread(
+        target=consume_loop, args=(consumer, loop, fetch_queue, stop), name="kafka-consumer", daemon=True
+    )
+    poll_thread.start()
+    health["poll_thread"] = poll_thread
+    lag_updated = 0.0
+
+    logger.info(
+        f"Product Command Handler started successfully "
+        f"({PROJECTION_WORKERS} workers, batch size {COMMAND_BATCH_SIZE}, batch timeout {COMMAND_BATCH_TIMEOUT}s)"
+    )
+
+    try:
+        while True:
+            try:
+                item, consumed_at = await asyncio.wait_for(fetch_queue.get(), timeout=COMMAND_BATCH_TIMEOUT)
+            except asyncio.TimeoutError:
+                item = None
+            if item is not None:
+                try:
+                    if isinstance(item, Exception):
+                        raise item
+                    await dispatch_batch(item, consumed_at, queues, tracker)
+                finally:
+                    fetch_queue.task_done()
+            commit_offsets(consumer, tracker.committable(), stats)
+            health["last_loop"] = time.monotonic()
+            if health["last_loop"] - lag_updated >= LAG_UPDATE_INTERVAL:
+                update_lag(consumer)
+                lag_updated = health["last_loop"]
+
+            if time.monotonic() - stats["started"] >= STATS_INTERVAL:
+                report_stats(stats, tracker, fetch_queue, queues)
+                reset_stats(stats)
 
     except KeyboardInterrupt:
         logger.info("Received shutdown signal")
-    except Exception as e:
-        logger.error(f"Kafka error: {msg.error().str()} (code: {msg.error().code()})")
+    except KafkaException as e:
+        logger.error(f"Kafka error: {e}")
     finally:
-        consumer.close()
+        stop.set()
+        await loop.run_in_executor(None, poll_thread.join)
+        # Непереданные воркерам пачки не зафиксированы и будут прочитаны повторно
+        while not fetch_queue.empty():
+            fetch_queue.get_nowait()
+            fetch_queue.task_done()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in queues)), timeout=10)
+            commit_offsets(consumer, tracker.committable(), stats, asynchronous=False)
+        except Exception as e:
+            logger.warning(f"Failed to drain workers on shutdown: {e}")
+        # close() вызывает on_revoke, который ждет event loop, поэтому не в его потоке
+        await loop.run_in_executor(None, consumer.close)
+        for worker in workers:
+            worker.cancel()
         mongo_client.close()
+        await cache.close()
+        metrics_server.shutdown()
         logger.info("Product Command Handler stopped")
 
 
@@ -0,0 +1,78 @@
+import asyncio
+
+from pymongo import InsertOne, UpdateOne
+
+import app as handler
+
+
+class FakeMessage:
+    def __init__(self, offset, value):
+        self._offset = offset
+        self._value = value
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return handler.KAFKA_TOPIC
+
+    def partition(self):
+        return 0
+
+    def offset(self):
+        return self._offset
+
+    def value(self):
+        return self._value
+
+
+def test_create_after_update_keeps_update_and_inserts_in_second_pass():
+    update = {"product_id": "prod_1", "action": "update", "price": 10.0}
+    create = {"product_id": "prod_1", "action": "create", "name": "Laptop", "price": 999.99}
+
+    ops, follow_up = handler.build_write_ops(handler.fold_events([update, create]))
+
+    # Существующий продукт: update применяется, insert отклоняется уникальным индексом.
+    # Нового продукта нет: update ничего не меняет, insert создает документ из create
+    assert ops == [UpdateOne({"product_id": "prod_1"}, {"$set": {"price": 10.0}})]
+    assert follow_up == [InsertOne(create)]
+
+
+def test_update_after_update_and_create_goes_to_both_passes():
+    first = {"product_id": "prod_1", "action": "update", "price": 10.0}
+    create = {"product_id": "prod_1", "action": "create", "name": "Laptop", "price": 999.99}
+    second = {"product_id": "prod_1", "action": "update", "name": "Notebook"}
+
+    ops, follow_up = handler.build_write_ops(handler.fold_events([first, create, second]))
+
+    assert ops == [UpdateOne({"product_id": "prod_1"}, {"$set": {"price": 10.0, "name": "Notebook"}})]
+    assert follow_up == [InsertOne({**create, "name": "Notebook"})]
+
+
+def test_update_after_create_in_one_batch_is_merged_into_insert():
+    create = {"product_id": "prod_1", "action": "create", "name": "Laptop", "price": 999.99}
+    update = {"product_id": "prod_1", "action": "update", "price": 10.0}
+
+    folded = handler.fold_events([create, update])
+
+    assert folded == {"prod_1": ("insert", {**create, "price": 10.0})}
+
+
+def test_invalid_events_are_skipped_and_committed():
+    messages = [
+        FakeMessage(0, b'["not", "an", "object"]'),
+        FakeMessage(1, b'"string"'),
+        FakeMessage(2, b'{"product_id": 42, "action": "create"}'),
+        FakeMessage(3, b"not json"),
+        FakeMessage(4, None),
+    ]
+    tracker = handler.OffsetTracker()
+
+    async def dispatch():
+        queues = [asyncio.Queue() for _ in range(handler.PROJECTION_WORKERS)]
+        await handler.dispatch_batch(messages, 0.0, queues, tracker)
+        return queues
+
+    assert all(queue.empty() for queue in asyncio.run(dispatch()))
+    [position] = tracker.committable()
+    assert position.offset == 5
@@ -1,15 +1,32 @@
+import asyncio
+import base64
 import logging
-from fastapi import FastAPI, Depends, HTTPException, status
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timedelta
 import jwt
 from passlib.context import CryptContext
 from uvicorn import run
-from confluent_kafka import Producer
+import orjson
+from confluent_kafka import Producer, KafkaException
+from redis import asyncio as aioredis
 import json
+from metrics import (
+    BACKEND_CALL_DURATION, BACKEND_CALL_ERRORS, CACHE_LOOKUPS,
+    InstrumentedRedis, MetricsMiddleware, metrics_response, track_backend,
+)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -22,17 +39,50 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 
 MONGO_URL = "mongodb://mongo:27017"
 DATABASE_NAME = "shop_db"
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+PRODUCTS_DEFAULT_LIMIT = int(os.getenv("PRODUCTS_DEFAULT_LIMIT", "10"))
+PRODUCTS_MAX_LIMIT = int(os.getenv("PRODUCTS_MAX_LIMIT", "100"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "50000"))
+REDIS_URL = "redis://redis:6379"
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+PRODUCT_CACHE_TTL = int(os.getenv("PRODUCT_CACHE_TTL", "300"))
+PRODUCT_LIST_CACHE_TTL = int(os.getenv("PRODUCT_LIST_CACHE_TTL", "60"))
 KAFKA_BROKER = "kafka:9092"
 KAFKA_TOPIC = "products"
+# Заголовки события для трассировки распространения записи до проекции в MongoDB
+TRACE_ID_HEADER = "trace_id"
+PRODUCED_AT_HEADER = "produced_at"
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", "5"))
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", "65536"))
+KAFKA_COMPRESSION_TYPE = os.getenv("KAFKA_COMPRESSION_TYPE", "lz4")
+KAFKA_QUEUE_MAX_MESSAGES = int(os.getenv("KAFKA_QUEUE_MAX_MESSAGES", "100000"))
+KAFKA_DELIVERY_TIMEOUT_MS = int(os.getenv("KAFKA_DELIVERY_TIMEOUT_MS", "10000"))
+KAFKA_RETRY_AFTER_SECONDS = int(os.getenv("KAFKA_RETRY_AFTER_SECONDS", "1"))
 
 SECRET_KEY = "my-secret-key"
 ALGORITHM = "HS256"
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="http://user-service:8000/token")
 
 
+# Из MongoDB забираем только поля модели Product; product_id отдается как id
+PRODUCT_PROJECTION = {
+    "_id": 0,
+    "id": "$product_id",
+    "name": 1,
+    "description": 1,
+    "price": 1,
+    "category": 1,
+}
+
+
 class Product(BaseModel):
     id: str
     name: str
@@ -48,28 +98,206 @@ class ProductCreate(BaseModel):
     category: Optional[str] = None
 
 
+class BulkItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+
+class BulkResult(BaseModel):
+    items: List[BulkItemResult]
+
+
+mongo_client: Optional[AsyncIOMotorClient] = None
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Время каждой команды MongoDB по событиям мониторинга драйвера"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        BACKEND_CALL_DURATION.labels("mongo", event.command_name).observe(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        BACKEND_CALL_DURATION.labels("mongo", event.command_name).observe(event.duration_micros / 1_000_000)
+        BACKEND_CALL_ERRORS.labels("mongo", event.command_name).inc()
+
+
+def create_mongo_client():
+    return AsyncIOMotorClient(
+        MONGO_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        event_listeners=[MongoCommandTimer()],
+    )
+
+
 async def get_db():
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client[DATABASE_NAME]
-    try:
-        yield db
-    finally:
-        client.close()
+    return mongo_client[DATABASE_NAME]
+
+
+redis_client: Optional[aioredis.Redis] = None
+cache_stats = {"product_hits": 0, "product_misses": 0, "list_hits": 0, "list_misses": 0}
+
+
+async def get_redis():
+    return redis_client
 
 
-def get_kafka_producer():
-    conf = {'bootstrap.servers': KAFKA_BROKER}
+def product_cache_key(product_id: str):
+    return f"product:{product_id}"
+
+
+def product_list_cache_key(category: Optional[str]):
+    # Все страницы категории лежат в одном hash, чтобы обработчик команд
+    # мог сбросить их одним DEL
+    return f"products:{category or '*'}"
+
+
+def cache_generation_key(cache_key: str):
+    # Обработчик команд увеличивает поколение ключа перед его удалением
+    return f"{cache_key}:gen"
+
+
+# Запись в кеш после чтения MongoDB, только если с момента чтения поколение
+# ключа не изменилось: иначе обработчик команд успел применить событие и сбросить
+# кеш, а прочитанный документ уже устарел.
+# KEYS: ключ, ключ поколения; ARGV: поколение до чтения ('' - нет), ttl, значение
+FILL_PRODUCT_CACHE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[3], 'EX', ARGV[2])
+return 1
+"""
+
+# То же для страницы в hash категории. ARGV: поколение, ttl, поле, значение.
+# TTL ставится только новому hash (NX): продление на каждом промахе не дало бы
+# ему истечь, пока к категории идут запросы
+FILL_PRODUCT_PAGE_CACHE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[3], ARGV[4])
+redis.call('EXPIRE', KEYS[1], ARGV[2], 'NX')
+return 1
+"""
+
+
+def cache_dumps(data):
+    return orjson.dumps(data, default=str)
+
+
+def hit_ratio(hits: int, misses: int):
+    total = hits + misses
+    return hits / total if total else 0.0
+
+
+fill_product_cache = None
+fill_product_page_cache = None
+producer: Optional[Producer] = None
+producer_stop = threading.Event()
+
+
+def create_kafka_producer():
+    conf = {
+        'bootstrap.servers': KAFKA_BROKER,
+        'linger.ms': KAFKA_LINGER_MS,
+        'batch.size': KAFKA_BATCH_SIZE,
+        'compression.type': KAFKA_COMPRESSION_TYPE,
+        'queue.buffering.max.messages': KAFKA_QUEUE_MAX_MESSAGES,
+        'delivery.timeout.ms': KAFKA_DELIVERY_TIMEOUT_MS,
+    }
     return Producer(**conf)
 
 
+def poll_kafka_producer():
+    """Обслуживание delivery-колбэков producer'а в отдельном потоке"""
+    while not producer_stop.is_set():
+        producer.poll(0.1)
+
+
+def _resolve_delivery(future, err, msg):
+    if future.done():
+        return
+    if err is not None:
+        future.set_exception(KafkaException(err))
+    else:
+        future.set_result(msg)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def publish_event(event: dict, trace_id: Optional[str] = None):
+    """Постановка события в очередь producer'а.
+
+    В заголовках сообщения - trace id и время постановки в очередь (мс),
+    по ним обработчик команд считает задержку до применения в MongoDB.
+    Возвращает future, который завершается при подтверждении доставки брокером.
+    При переполнении локальной очереди librdkafka выбрасывает BufferError.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    started = time.perf_counter()
+
+    def on_delivery(err, msg):
+        # Время от постановки в очередь до подтверждения брокером
+        BACKEND_CALL_DURATION.labels("kafka", "delivery").observe(time.perf_counter() - started)
+        if err is not None:
+            BACKEND_CALL_ERRORS.labels("kafka", "delivery").inc()
+        delivery_report(err, msg)
+        loop.call_soon_threadsafe(_resolve_delivery, future, err, msg)
+
+    # Ключ product_id отправляет все события продукта в одну партицию,
+    # что сохраняет их порядок для обработчика команд
+    with track_backend("kafka", "produce"):
+        producer.produce(
+            topic=KAFKA_TOPIC,
+            key=event["product_id"],
+            value=json.dumps(event),
+            headers=[
+                (TRACE_ID_HEADER, trace_id or new_trace_id()),
+                (PRODUCED_AT_HEADER, str(int(time.time() * 1000))),
+            ],
+            on_delivery=on_delivery
+        )
+    return future
+
+
+def queue_full_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Event queue is full, retry later",
+        headers={"Retry-After": str(KAFKA_RETRY_AFTER_SECONDS)},
+    )
+
+
 @app.on_event("startup")
 async def startup_event():
+    global mongo_client, producer, redis_client, fill_product_cache, fill_product_page_cache
+    redis_client = InstrumentedRedis.from_url(REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS, socket_keepalive=True)
+    fill_product_cache = redis_client.register_script(FILL_PRODUCT_CACHE_SCRIPT)
+    fill_product_page_cache = redis_client.register_script(FILL_PRODUCT_PAGE_CACHE_SCRIPT)
+    producer = create_kafka_producer()
+    threading.Thread(target=poll_kafka_producer, name="kafka-producer-poll", daemon=True).start()
+    logger.info(f"Kafka producer ready (linger.ms={KAFKA_LINGER_MS}, batch.size={KAFKA_BATCH_SIZE}, compression={KAFKA_COMPRESSION_TYPE})")
+
     logger.info("Initializing MongoDB...")
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client[DATABASE_NAME]
+    # Один клиент (и пул соединений) на все время жизни процесса
+    mongo_client = create_mongo_client()
+    db = mongo_client[DATABASE_NAME]
     try:
+        await mongo_client.admin.command("ping")
+        logger.info(f"MongoDB client ready (minPoolSize={MONGO_MIN_POOL_SIZE}, maxPoolSize={MONGO_MAX_POOL_SIZE})")
         await db.products.create_index([("product_id", 1)], unique=True)
-        await db.products.create_index([("category", 1)])
+        # Покрывает и фильтр по категории, и сортировку по _id для курсора
+        await db.products.create_index([("category", 1), ("_id", 1)])
         logger.info("MongoDB indexes created")
 
         if await db.products.count_documents({}) == 0:
@@ -96,7 +324,77 @@ async def startup_event():
         logger.error(f"MongoDB initialization error: {e}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if producer is not None:
+        remaining = await asyncio.get_running_loop().run_in_executor(None, producer.flush, 10)
+        producer_stop.set()
+        if remaining:
+            logger.warning(f"{remaining} Kafka messages were not delivered before shutdown")
+    if redis_client is not None:
+        await redis_client.close()
+        await redis_client.connection_pool.disconnect()
+    if mongo_client is not None:
+        mongo_client.close()
+        logger.info("MongoDB client closed")
+
+
+class PrincipalCache:
+    """Кеш результатов проверки токена (имя пользователя по токену).
+
+    Запись живет не дольше PRINCIPAL_CACHE_TTL и не дольше срока действия
+    самого токена; invalidate() сразу сбрасывает все токены пользователя.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tokens_by_subject = {}
+
+    def get(self, token: str):
+        item = self.entries.get(token)
+        if item is None:
+            return None
+        principal, subject, expires_at = item
+        if time.time() >= expires_at:
+            self._remove(token)
+            return None
+        self.entries.move_to_end(token)
+        return principal
+
+    def set(self, token: str, subject: str, principal, token_expires_at: Optional[float] = None):
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        self._remove(token)
+        self.entries[token] = (principal, subject, expires_at)
+        self.tokens_by_subject.setdefault(subject, set()).add(token)
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def invalidate(self, subject: str):
+        for token in self.tokens_by_subject.pop(subject, set()):
+            self.entries.pop(token, None)
+
+    def _remove(self, token: str):
+        item = self.entries.pop(token, None)
+        if item is None:
+            return
+        tokens = self.tokens_by_subject.get(item[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_subject[item[1]]
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL)
+
+
 async def verify_token(token: str = Depends(oauth2_scheme)):
+    username = principal_cache.get(token)
+    if username is not None:
+        return username
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -106,6 +404,7 @@ async def verify_token(token: str = Depends(oauth2_scheme)):
                 detail="Invalid credentials",
             )
         logger.info(f"Authenticated user: {username}")
+        principal_cache.set(token, username, username, payload.get("exp"))
         return username
     except jwt.ExpiredSignatureError:
         logger.warning("Token expired")
@@ -119,12 +418,14 @@ def delivery_report(err, msg):
     if err is not None:
         logger.error(f'Message delivery failed: {err}')
     else:
-        logger.info(f'Message delivered to {msg.topic()} [{msg.partition()}]')
+        # debug: при пакетной загрузке по строке на каждое сообщение забивает лог
+        logger.debug(f'Message delivered to {msg.topic()} [{msg.partition()}]')
 
 
 @app.post("/products/", response_model=Product, status_code=201)
 async def create_product(
         product: ProductCreate,
+        response: Response,
         db=Depends(get_db),
         username: str = Depends(verify_token)
 ):
@@ -137,48 +438,232 @@ async def create_product(
         "action": "create"
     }
 
-    producer = get_kafka_producer()
+    trace_id = new_trace_id()
     try:
-        producer.produce(
-            topic=KAFKA_TOPIC,
-            value=json.dumps(product_data),
-            callback=delivery_report
-        )
-        producer.flush()
-        logger.info(f"Product event sent to Kafka: {product_id}")
+        await publish_event(product_data, trace_id)
+        logger.info(f"Product event sent to Kafka: {product_id} (trace {trace_id})")
+        response.headers["X-Trace-Id"] = trace_id
+    except BufferError:
+        logger.warning(f"Kafka producer queue is full, rejecting event: {product_id}")
+        raise queue_full_exception()
     except Exception as e:
         logger.error(f"Error sending to Kafka: {e}")
         raise HTTPException(status_code=500, detail="Error processing product")
 
-    return product_data
+    return {"id": product_id, **product_data}
+
+
+async def parse_bulk_products(request: Request):
+    """Разбор тела bulk-запроса: JSON-массив или NDJSON (по строке на продукт)
+
+    Возвращает список (ProductCreate или None, ошибка) в порядке элементов;
+    невалидные элементы не прерывают разбор остальных.
+    """
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        raw_items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                raw_items.append(orjson.loads(line))
+            except orjson.JSONDecodeError as e:
+                raw_items.append(e)
+    else:
+        try:
+            raw_items = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(raw_items, list):
+            raise HTTPException(status_code=400, detail="Expected a list of products")
+
+    if len(raw_items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many products (max {BULK_MAX_ITEMS})")
+
+    parsed = []
+    for raw in raw_items:
+        if isinstance(raw, Exception):
+            parsed.append((None, f"Invalid JSON: {raw}"))
+            continue
+        try:
+            parsed.append((ProductCreate.parse_obj(raw), None))
+        except ValidationError as e:
+            parsed.append((None, str(e)))
+    return parsed
+
+
+async def publish_event_waiting(event: dict):
+    """publish_event, который при переполненной очереди producer'а ждет ее
+    освобождения до KAFKA_RETRY_AFTER_SECONDS, прежде чем выбросить BufferError"""
+    deadline = time.monotonic() + KAFKA_RETRY_AFTER_SECONDS
+    while True:
+        try:
+            return publish_event(event)
+        except BufferError:
+            if time.monotonic() >= deadline:
+                raise
+            await asyncio.sleep(0.01)
+
+
+@app.post("/products/bulk", response_model=BulkResult)
+async def create_products_bulk(
+        request: Request,
+        db=Depends(get_db),
+        username: str = Depends(verify_token)
+):
+    """Пакетное создание продуктов - все события ставятся в очередь producer'а
+    подряд, подтверждения доставки ожидаются один раз для всего пакета"""
+    parsed = await parse_bulk_products(request)
+    batch_id = datetime.now().timestamp()
+    created_at = datetime.utcnow().isoformat()
+    results = []
+    deliveries = []
+    queue_full = False
+    for index, (product, error) in enumerate(parsed):
+        if product is None:
+            results.append({"index": index, "status": "invalid", "error": error})
+            continue
+        product_id = f"prod_{batch_id}_{index}"
+        result = {"index": index, "id": product_id, "status": "accepted"}
+        results.append(result)
+        event = {
+            "product_id": product_id,
+            **product.dict(),
+            "created_at": created_at,
+            "action": "create"
+        }
+        if not queue_full:
+            try:
+                deliveries.append((result, await publish_event_waiting(event)))
+                continue
+            except BufferError:
+                logger.warning(f"Kafka producer queue is full, rejecting the rest of the batch from {product_id}")
+                queue_full = True
+        result["status"] = "rejected"
+        result["error"] = "Event queue is full, retry later"
+
+    outcomes = await asyncio.gather(*(future for _, future in deliveries), return_exceptions=True)
+    for (result, _), outcome in zip(deliveries, outcomes):
+        if isinstance(outcome, Exception):
+            result["status"] = "failed"
+            result["error"] = str(outcome)
+
+    accepted = sum(1 for r in results if r["status"] == "accepted")
+    logger.info(f"Bulk create: {accepted} of {len(results)} product events delivered to Kafka")
+    return ORJSONResponse({"items": results})
+
+
+def encode_product_cursor(object_id: ObjectId):
+    return base64.urlsafe_b64encode(object_id.binary).decode()
+
+
+def decode_product_cursor(cursor: str):
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def fetch_product_page(db, category: Optional[str], skip: int, limit: int, after: Optional[str]):
+    """Страница продуктов в порядке _id и курсор следующей страницы (или None)
+
+    С курсором выборка продолжается по индексу (category, _id) без skip;
+    skip оставлен для старых клиентов и применяется только без курсора.
+    """
+    query = {"category": category} if category else {}
+    if after:
+        query["_id"] = {"$gt": decode_product_cursor(after)}
+    cursor = db.products.find(query, {**PRODUCT_PROJECTION, "_id": 1}).sort("_id", 1)
+    if skip and not after:
+        cursor = cursor.skip(skip)
+    products = await cursor.limit(limit).to_list(limit)
+    next_cursor = None
+    if len(products) == limit:
+        next_cursor = encode_product_cursor(products[-1]["_id"])
+    for product in products:
+        del product["_id"]
+    return products, next_cursor
 
 
 @app.get("/products/", response_model=List[Product])
 async def get_products(
         category: Optional[str] = None,
-        skip: int = 0,
-        limit: int = 10,
-        db=Depends(get_db)
+        skip: int = Query(0, ge=0),
+        limit: int = Query(PRODUCTS_DEFAULT_LIMIT, ge=1, le=PRODUCTS_MAX_LIMIT),
+        after: Optional[str] = None,
+        db=Depends(get_db),
+        redis=Depends(get_redis)
 ):
-    """Получение списка продуктов из MongoDB"""
-    query = {"category": category} if category else {}
-    products = await db.products.find(query).skip(skip).limit(limit).to_list(limit)
-    return products
+    """Получение списка продуктов: Redis, затем MongoDB"""
+    cache_key = product_list_cache_key(category)
+    page = f"{after or ''}:{0 if after else skip}:{limit}"
+    cached = await redis.hget(cache_key, page)
+    if cached:
+        cache_stats["list_hits"] += 1
+        CACHE_LOOKUPS.labels("products", "hit").inc()
+        result = orjson.loads(cached)
+    else:
+        cache_stats["list_misses"] += 1
+        CACHE_LOOKUPS.labels("products", "miss").inc()
+        generation_key = cache_generation_key(cache_key)
+        generation = await redis.get(generation_key)
+        products, next_cursor = await fetch_product_page(db, category, skip, limit, after)
+        result = {"items": products, "next": next_cursor}
+        await fill_product_page_cache(
+            keys=[cache_key, generation_key],
+            args=[generation or "", PRODUCT_LIST_CACHE_TTL, page, cache_dumps(result)],
+        )
+    # Документы уже в форме ответа: отдаем их без повторной валидации response_model
+    headers = {"X-Next-Cursor": result["next"]} if result["next"] else None
+    return ORJSONResponse(result["items"], headers=headers)
 
 
 @app.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str, db=Depends(get_db)):
-    """Получение продукта по ID из MongoDB"""
-    product = await db.products.find_one({"product_id": product_id})
+async def get_product(product_id: str, db=Depends(get_db), redis=Depends(get_redis)):
+    """Получение продукта по ID: Redis, затем MongoDB"""
+    cache_key = product_cache_key(product_id)
+    cached = await redis.get(cache_key)
+    if cached:
+        cache_stats["product_hits"] += 1
+        CACHE_LOOKUPS.labels("product", "hit").inc()
+        # В кеше уже готовое тело ответа
+        return Response(cached, media_type="application/json")
+    cache_stats["product_misses"] += 1
+    CACHE_LOOKUPS.labels("product", "miss").inc()
+
+    generation_key = cache_generation_key(cache_key)
+    generation = await redis.get(generation_key)
+    product = await db.products.find_one({"product_id": product_id}, PRODUCT_PROJECTION)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    body = cache_dumps(product)
+    await fill_product_cache(keys=[cache_key, generation_key], args=[generation or "", PRODUCT_CACHE_TTL, body])
+    return Response(body, media_type="application/json")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics_response()
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "cache": {
+            **cache_stats,
+            "product_hit_ratio": hit_ratio(cache_stats["product_hits"], cache_stats["product_misses"]),
+            "list_hit_ratio": hit_ratio(cache_stats["list_hits"], cache_stats["list_misses"]),
+            "product_ttl": PRODUCT_CACHE_TTL,
+            "list_ttl": PRODUCT_LIST_CACHE_TTL,
+        }
+    }
 
 
 @app.put("/products/{product_id}", response_model=Product)
 async def update_product(
         product_id: str,
         product: ProductCreate,
+        response: Response,
         db=Depends(get_db),
         username: str = Depends(verify_token)
 ):
@@ -190,25 +675,25 @@ async def update_product(
         "action": "update"
     }
 
-    producer = get_kafka_producer()
+    trace_id = new_trace_id()
     try:
-        producer.produce(
-            topic=KAFKA_TOPIC,
-            value=json.dumps(product_data),
-            callback=delivery_report
-        )
-        producer.flush()
-        logger.info(f"Product update event sent to Kafka: {product_id}")
+        await publish_event(product_data, trace_id)
+        logger.info(f"Product update event sent to Kafka: {product_id} (trace {trace_id})")
+        response.headers["X-Trace-Id"] = trace_id
+    except BufferError:
+        logger.warning(f"Kafka producer queue is full, rejecting event: {product_id}")
+        raise queue_full_exception()
     except Exception as e:
         logger.error(f"Error sending to Kafka: {e}")
         raise HTTPException(status_code=500, detail="Error processing product update")
 
-    return product_data
+    return {"id": product_id, **product_data}
 
 
 @app.delete("/products/{product_id}", status_code=204)
 async def delete_product(
         product_id: str,
+        response: Response,
         db=Depends(get_db),
         username: str = Depends(verify_token)
 ):
@@ -219,15 +704,14 @@ async def delete_product(
         "deleted_at": datetime.utcnow().isoformat()
     }
 
-    producer = get_kafka_producer()
+    trace_id = new_trace_id()
     try:
-        producer.produce(
-            topic=KAFKA_TOPIC,
-            value=json.dumps(delete_data),
-            callback=delivery_report
-        )
-        producer.flush()
-        logger.info(f"Product delete event sent to Kafka: {product_id}")
+        await publish_event(delete_data, trace_id)
+        logger.info(f"Product delete event sent to Kafka: {product_id} (trace {trace_id})")
+        response.headers["X-Trace-Id"] = trace_id
+    except BufferError:
+        logger.warning(f"Kafka producer queue is full, rejecting event: {product_id}")
+        raise queue_full_exception()
     except Exception as e:
         logger.error(f"Error sending to Kafka: {e}")
         raise HTTPException(status_code=500, detail="Error processing product deletion")
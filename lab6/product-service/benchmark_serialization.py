@@ -0,0 +1,73 @@
+"""Сериализация страницы продуктов: response_model + json против ORJSONResponse.
+
+Первый вариант повторяет путь FastAPI по умолчанию (валидация через
+response_model, jsonable_encoder, json.dumps), второй - быстрый путь
+get_products/get_product: готовые dict из проекции сразу кодируются orjson.
+
+Запуск: python benchmark_serialization.py [--sizes 1 10 100]
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Optional
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from pydantic import BaseModel
+
+
+class Product(BaseModel):
+    id: str
+    name: str
+    description: Optional[str] = None
+    price: float
+    category: Optional[str] = None
+
+
+def build_page(size):
+    # Документы в том виде, в каком их отдает PRODUCT_PROJECTION
+    return [
+        {
+            "id": f"prod_{i + 1}",
+            "name": f"Product {i + 1}",
+            "description": "High performance laptop",
+            "price": 999.99,
+            "category": "Electronics",
+        }
+        for i in range(size)
+    ]
+
+
+async def measure_response_model(field, page, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        content = await serialize_response(field=field, response_content=page)
+        JSONResponse(content).body
+    return (time.perf_counter() - started) / calls * 1000
+
+
+def measure_orjson(page, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        ORJSONResponse(page).body
+    return (time.perf_counter() - started) / calls * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    field = create_response_field(name="response", type_=List[Product])
+    print(f"{'page size':>10} {'response_model, ms':>19} {'orjson, ms':>11} {'speedup':>9}")
+    for size in args.sizes:
+        page = build_page(size)
+        slow_ms = asyncio.run(measure_response_model(field, page, args.calls))
+        fast_ms = measure_orjson(page, args.calls)
+        print(f"{size:>10} {slow_ms:>19.4f} {fast_ms:>11.4f} {slow_ms / fast_ms:>8.0f}x")
+
+
+if __name__ == "__main__":
+    main()
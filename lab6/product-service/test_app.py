@@ -0,0 +1,55 @@
+from fastapi.testclient import TestClient
+
+import app as service
+
+PRODUCT = {"name": "Laptop", "description": "High performance laptop", "price": 999.99, "category": "Electronics"}
+
+
+class FakeMessage:
+    def topic(self):
+        return service.KAFKA_TOPIC
+
+    def partition(self):
+        return 0
+
+
+class FakeProducer:
+    """Producer, сразу подтверждающий доставку и запоминающий сообщения"""
+
+    def __init__(self):
+        self.messages = []
+
+    def produce(self, topic, key, value, headers, on_delivery):
+        self.messages.append({"key": key, "value": value, "headers": dict(headers)})
+        on_delivery(None, FakeMessage())
+
+
+def make_client():
+    service.producer = FakeProducer()
+    service.app.dependency_overrides[service.verify_token] = lambda: "admin"
+    service.app.dependency_overrides[service.get_db] = lambda: None
+    return TestClient(service.app)
+
+
+def test_create_product_returns_id_and_trace_id():
+    client = make_client()
+
+    response = client.post("/products/", json=PRODUCT)
+
+    assert response.status_code == 201
+    body = response.json()
+    assert body["id"].startswith("prod_")
+    assert body["name"] == PRODUCT["name"]
+    headers = service.producer.messages[0]["headers"]
+    assert response.headers["X-Trace-Id"] == headers[service.TRACE_ID_HEADER]
+    assert int(headers[service.PRODUCED_AT_HEADER]) > 0
+
+
+def test_update_product_returns_id_and_trace_id():
+    client = make_client()
+
+    response = client.put("/products/prod_1", json=PRODUCT)
+
+    assert response.status_code == 200
+    assert response.json()["id"] == "prod_1"
+    assert response.headers["X-Trace-Id"] == service.producer.messages[0]["headers"][service.TRACE_ID_HEADER]
@@ -0,0 +1,101 @@
+"""Накладные расходы метрик: запрос к приложению FastAPI без MetricsMiddleware
+и с ней, плюс стоимость одного track_backend вокруг обращения к хранилищу.
+
+Запросы подаются прямо в ASGI-приложение, без сети и сервера, поэтому
+разница между вариантами - это стоимость самой инструментации.
+
+Запуск: python benchmark_metrics.py [--requests 20000]
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+from metrics import MetricsMiddleware, track_backend
+
+USER = {"username": "admin", "full_name": "Admin User", "email": "admin@example.com", "disabled": False}
+
+
+def build_app(instrumented: bool):
+    app = FastAPI()
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+
+    # Несколько маршрутов впереди, чтобы поиск шаблона пути не был тривиальным
+    for i in range(10):
+        app.get(f"/other/{i}/{{item_id}}")(lambda item_id: None)
+
+    @app.get("/users/{username}")
+    async def read_user(username: str):
+        return ORJSONResponse(USER)
+
+    return app
+
+
+async def call(app, path: str):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", 8000),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def measure_requests(app, requests: int):
+    for _ in range(1000):
+        await call(app, "/users/admin")
+    started = time.perf_counter()
+    for i in range(requests):
+        await call(app, f"/users/user_{i}")
+    return (time.perf_counter() - started) / requests * 1_000_000
+
+
+async def measure_backend_calls(calls: int, instrumented: bool):
+    async def backend_call():
+        return None
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        if instrumented:
+            with track_backend("postgres", "fetchrow"):
+                await backend_call()
+        else:
+            await backend_call()
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    plain_us = await measure_requests(build_app(False), args.requests)
+    metrics_us = await measure_requests(build_app(True), args.requests)
+    call_us = await measure_backend_calls(args.requests * 5, False)
+    tracked_us = await measure_backend_calls(args.requests * 5, True)
+
+    print(f"{'':>24} {'plain, us':>10} {'metrics, us':>12} {'overhead, us':>13}")
+    print(f"{'HTTP request':>24} {plain_us:>10.1f} {metrics_us:>12.1f} {metrics_us - plain_us:>13.1f}")
+    print(f"{'backend call':>24} {call_us:>10.2f} {tracked_us:>12.2f} {tracked_us - call_us:>13.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
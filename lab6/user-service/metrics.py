@@ -0,0 +1,154 @@
+"""Метрики Prometheus: латентность HTTP-маршрутов, запросы в работе,
+время обращений к хранилищам и брокеру.
+
+Маршрут в метках - шаблон пути FastAPI, а не путь запроса, чтобы число
+временных рядов не зависело от данных запросов.
+"""
+import time
+
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from redis import asyncio as aioredis
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP-запросы в обработке",
+    ["method", "route"],
+)
+BACKEND_CALL_DURATION = Histogram(
+    "backend_call_duration_seconds",
+    "Время обращения к PostgreSQL, MongoDB, Redis или Kafka",
+    ["backend", "operation"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+BACKEND_CALL_ERRORS = Counter(
+    "backend_call_errors_total",
+    "Обращения к хранилищам и брокеру, завершившиеся ошибкой",
+    ["backend", "operation"],
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Обращения к кешу по результату",
+    ["cache", "result"],
+)
+
+
+# Дочерние серии по меткам кешируются: labels() заметно дороже словаря
+_backend_series = {}
+
+
+def backend_series(backend: str, operation: str):
+    series = _backend_series.get((backend, operation))
+    if series is None:
+        series = (
+            BACKEND_CALL_DURATION.labels(backend, operation),
+            BACKEND_CALL_ERRORS.labels(backend, operation),
+        )
+        _backend_series[(backend, operation)] = series
+    return series
+
+
+class BackendTimer:
+    """Контекстный менеджер замера одного обращения к хранилищу или брокеру"""
+
+    __slots__ = ("series", "started")
+
+    def __init__(self, series):
+        self.series = series
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        duration, errors = self.series
+        duration.observe(time.perf_counter() - self.started)
+        if exc_type is not None:
+            errors.inc()
+
+
+def track_backend(backend: str, operation: str):
+    return BackendTimer(backend_series(backend, operation))
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """Клиент Redis, замеряющий каждую команду (pipeline замеряется снаружи)"""
+
+    async def execute_command(self, *args, **options):
+        with track_backend("redis", str(args[0]).lower()):
+            return await super().execute_command(*args, **options)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма латентности и счетчик запросов в работе.
+
+    Чистый ASGI без BaseHTTPMiddleware - тело ответа не буферизуется,
+    а накладные расходы сводятся к поиску маршрута и двум обновлениям метрик.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes_by_method = None
+        self.in_progress = {}
+        self.durations = {}
+
+    def build_route_table(self, app):
+        # Для каждого метода - (match, шаблон) в порядке маршрутизации FastAPI;
+        # только регулярное выражение пути, без дорогого route.matches()
+        table = {}
+        for route in app.router.routes:
+            path_regex = getattr(route, "path_regex", None)
+            if path_regex is None:
+                continue
+            for method in getattr(route, "methods", None) or ():
+                table.setdefault(method, []).append((path_regex.match, route.path))
+        return table
+
+    def route_template(self, scope):
+        if self.routes_by_method is None:
+            self.routes_by_method = self.build_route_table(scope["app"])
+        path = scope["path"]
+        for match, template in self.routes_by_method.get(scope["method"], ()):
+            if match(path):
+                return template
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self.route_template(scope)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress = self.in_progress.get((method, route))
+        if in_progress is None:
+            in_progress = self.in_progress[(method, route)] = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            key = (method, route, status_code)
+            duration = self.durations.get(key)
+            if duration is None:
+                duration = self.durations[key] = HTTP_REQUEST_DURATION.labels(method, route, str(status_code))
+            duration.observe(elapsed)
+
+
+def metrics_response():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)